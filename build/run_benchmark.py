@@ -1,14 +1,28 @@
+from __future__ import annotations
+
 import argparse
-import json
+import gzip
 import logging
+import math
+import re
+import shutil
 import subprocess
 import sys
 import os
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Dict, Any, BinaryIO, Iterator, List, Optional
+
+# mlflow, pyarrow, ijson and huggingface_hub are imported where they are used,
+# so --help (the image's default command) and argument errors return quickly
+if TYPE_CHECKING:
+    from mlflow.entities import Metric
 
-import mlflow
+# MLflow rejects log_batch requests carrying more than 1000 metrics
+MAX_METRICS_PER_BATCH = 1000
+# One key=value entry of a --data profile, e.g. "prompt_tokens=1000"
+_DATA_PARAM_RE = re.compile(r"\s*([^=\s]+)\s*=(.*)")
 
 
 logging.basicConfig(
@@ -19,20 +33,135 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# (metric name, key path into a guidellm benchmark object)
+METRIC_SPECS = (
+    # Request stats
+    ("total_requests", ("run_stats", "requests_made", "total")),
+    ("successful_requests", ("run_stats", "requests_made", "successful")),
+    ("failed_requests", ("run_stats", "requests_made", "errored")),
+    # Throughput
+    (
+        "throughput_requests_per_sec",
+        ("metrics", "requests_per_second", "successful", "mean"),
+    ),
+    (
+        "throughput_tokens_per_sec",
+        ("metrics", "tokens_per_second", "successful", "mean"),
+    ),
+    # Latency (Overall Request)
+    ("latency_mean_sec", ("metrics", "request_latency", "successful", "mean")),
+    ("latency_median_sec", ("metrics", "request_latency", "successful", "median")),
+    (
+        "latency_p50_sec",
+        ("metrics", "request_latency", "successful", "percentiles", "p50"),
+    ),
+    (
+        "latency_p90_sec",
+        ("metrics", "request_latency", "successful", "percentiles", "p90"),
+    ),
+    (
+        "latency_p95_sec",
+        ("metrics", "request_latency", "successful", "percentiles", "p95"),
+    ),
+    (
+        "latency_p99_sec",
+        ("metrics", "request_latency", "successful", "percentiles", "p99"),
+    ),
+    # TTFT
+    ("ttft_mean_ms", ("metrics", "time_to_first_token_ms", "successful", "mean")),
+    ("ttft_median_ms", ("metrics", "time_to_first_token_ms", "successful", "median")),
+    (
+        "ttft_p95_ms",
+        ("metrics", "time_to_first_token_ms", "successful", "percentiles", "p95"),
+    ),
+    (
+        "ttft_p99_ms",
+        ("metrics", "time_to_first_token_ms", "successful", "percentiles", "p99"),
+    ),
+    # ITL
+    ("itl_mean_ms", ("metrics", "inter_token_latency_ms", "successful", "mean")),
+    ("itl_median_ms", ("metrics", "inter_token_latency_ms", "successful", "median")),
+    (
+        "itl_p95_ms",
+        ("metrics", "inter_token_latency_ms", "successful", "percentiles", "p95"),
+    ),
+    # Tokens
+    (
+        "total_input_tokens",
+        ("metrics", "prompt_token_count", "successful", "total_sum"),
+    ),
+    (
+        "total_output_tokens",
+        ("metrics", "output_token_count", "successful", "total_sum"),
+    ),
+)
+
+
+def _deep_get(obj: Any, path: tuple) -> Any:
+    for key in path:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def parse_data_params(data: str) -> Dict[str, str]:
+    """Split a --data profile into params, or return {} unless every
+    comma-separated entry is a well-formed key=value pair.
+
+    >>> parse_data_params("prompt_tokens=1000, output_tokens = 500")
+    {'prompt_tokens': '1000', 'output_tokens': '500'}
+    >>> parse_data_params("prompt_tokens=10,source=a=b")
+    {'prompt_tokens': '10', 'source': 'a=b'}
+    >>> parse_data_params("prompt tokens=5")
+    {}
+    >>> parse_data_params("prompt_tokens=1000,foo")
+    {}
+    >>> parse_data_params("/data/prompts.json")
+    {}
+    """
+    params = {}
+    for entry in data.split(","):
+        match = _DATA_PARAM_RE.fullmatch(entry)
+        if match is None:
+            return {}
+        params[match.group(1)] = match.group(2).strip()
+    return params
+
+
+def _as_step(value: Any) -> Optional[int]:
+    # Only numbers and digit strings are usable steps, anything else is skipped
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if math.isfinite(value) else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def get_concurrency_step(benchmark: Dict[str, Any]) -> Optional[int]:
+    streams = _as_step(_deep_get(benchmark, ("args", "strategy", "streams")))
+    if streams is not None:
+        return streams
+
+    # Fallback for other strategies
+    measured = _deep_get(benchmark, ("args", "profile", "measured_concurrencies"))
+    if isinstance(measured, list) and measured:
+        return _as_step(measured[0])
+
+    return None
+
+
 def extract_metrics_from_benchmark(benchmark: Dict[str, Any]) -> Dict[str, Any]:
     metrics = {}
     try:
-        run_stats = benchmark.get("run_stats", {})
-        all_metrics = benchmark.get("metrics", {})
-
-        # Request stats
-        requests_made = run_stats.get("requests_made", {})
-        if "total" in requests_made:
-            metrics["total_requests"] = requests_made["total"]
-        if "successful" in requests_made:
-            metrics["successful_requests"] = requests_made["successful"]
-        if "errored" in requests_made:
-            metrics["failed_requests"] = requests_made["errored"]
+        for key, path in METRIC_SPECS:
+            value = _deep_get(benchmark, path)
+            if value is not None:
+                metrics[key] = value
 
         # Error Rate
         if metrics.get("total_requests", 0) > 0 and "failed_requests" in metrics:
@@ -42,82 +171,106 @@ def extract_metrics_from_benchmark(benchmark: Dict[str, Any]) -> Dict[str, Any]:
         elif "total_requests" in metrics:
             metrics["error_rate"] = 0.0
 
-        # Throughput
-        req_throughput = all_metrics.get("requests_per_second", {}).get(
-            "successful", {}
-        )
-        if "mean" in req_throughput:
-            metrics["throughput_requests_per_sec"] = req_throughput["mean"]
-
-        tok_throughput = all_metrics.get("tokens_per_second", {}).get("successful", {})
-        if "mean" in tok_throughput:
-            metrics["throughput_tokens_per_sec"] = tok_throughput["mean"]
-
-        # Latency (Overall Request)
-        latency = all_metrics.get("request_latency", {}).get("successful", {})
-        latency_pct = latency.get("percentiles", {})
-        if "mean" in latency:
-            metrics["latency_mean_sec"] = latency["mean"]
-        if "median" in latency:
-            metrics["latency_median_sec"] = latency["median"]
-        if "p50" in latency_pct:
-            metrics["latency_p50_sec"] = latency_pct["p50"]
-        if "p90" in latency_pct:
-            metrics["latency_p90_sec"] = latency_pct["p90"]
-        if "p95" in latency_pct:
-            metrics["latency_p95_sec"] = latency_pct["p95"]
-        if "p99" in latency_pct:
-            metrics["latency_p99_sec"] = latency_pct["p99"]
-
-        # TTFT
-        ttft = all_metrics.get("time_to_first_token_ms", {}).get("successful", {})
-        ttft_pct = ttft.get("percentiles", {})
-        if "mean" in ttft:
-            metrics["ttft_mean_ms"] = ttft["mean"]
-        if "median" in ttft:
-            metrics["ttft_median_ms"] = ttft["median"]
-        if "p95" in ttft_pct:
-            metrics["ttft_p95_ms"] = ttft_pct["p95"]
-        if "p99" in ttft_pct:
-            metrics["ttft_p99_ms"] = ttft_pct["p99"]
-
-        # ITL
-        itl = all_metrics.get("inter_token_latency_ms", {}).get("successful", {})
-        itl_pct = itl.get("percentiles", {})
-        if "mean" in itl:
-            metrics["itl_mean_ms"] = itl["mean"]
-        if "median" in itl:
-            metrics["itl_median_ms"] = itl["median"]
-        if "p95" in itl_pct:
-            metrics["itl_p95_ms"] = itl_pct["p95"]
-
         # Tokens
-        input_tokens = all_metrics.get("prompt_token_count", {}).get("successful", {})
-        output_tokens = all_metrics.get("output_token_count", {}).get("successful", {})
-
-        total_input = 0
-        if "total_sum" in input_tokens:
-            total_input = input_tokens["total_sum"]
-            metrics["total_input_tokens"] = total_input
-
-        total_output = 0
-        if "total_sum" in output_tokens:
-            total_output = output_tokens["total_sum"]
-            metrics["total_output_tokens"] = total_output
-
+        total_input = metrics.get("total_input_tokens", 0)
+        total_output = metrics.get("total_output_tokens", 0)
         if total_input > 0 or total_output > 0:
             metrics["total_tokens"] = total_input + total_output
 
-        logger.info(f"Extracted {len(metrics)} metrics from benchmark object")
+        logger.info("Extracted %d metrics from benchmark object", len(metrics))
         return metrics
 
     except Exception as e:
         logger.error(
-            f"Error extracting metrics from benchmark object: {e}", exc_info=True
+            "Error extracting metrics from benchmark object: %s", e, exc_info=True
         )
         return {}
 
 
+def iter_benchmarks(json_file: BinaryIO) -> Iterator[Dict[str, Any]]:
+    import ijson
+
+    # Stream one benchmark at a time instead of loading the whole sweep output
+    yield from ijson.items(json_file, "benchmarks.item", use_float=True)
+
+
+def collect_sweep_metrics(json_path: str) -> Optional[List[Metric]]:
+    from mlflow.entities import Metric
+
+    try:
+        json_file = open(json_path, "rb")
+    except FileNotFoundError:
+        return None
+
+    benchmark_count = 0
+    metrics_batch = []
+    with json_file:
+        for benchmark in iter_benchmarks(json_file):
+            benchmark_count += 1
+            concurrency_step = get_concurrency_step(benchmark)
+            if concurrency_step is None:
+                concurrency_step = 0
+                logger.warning(
+                    "Could not find concurrency 'streams' or "
+                    "'measured_concurrencies'. "
+                    "Metrics will be logged without a step."
+                )
+
+            metrics = extract_metrics_from_benchmark(benchmark)
+
+            if metrics:
+                # Use the concurrency as the step for every metric
+                timestamp = int(time.time() * 1000)
+                metrics_batch.extend(
+                    Metric(key, float(value), timestamp, concurrency_step)
+                    for key, value in metrics.items()
+                )
+
+                logger.info(
+                    "Collected %d metrics for step (concurrency=%d)",
+                    len(metrics),
+                    concurrency_step,
+                )
+
+    if not benchmark_count:
+        logger.warning("No benchmarks found in JSON output")
+
+    logger.info("Found %d benchmark results in JSON.", benchmark_count)
+    return metrics_batch
+
+
+def log_metrics_batch(run_id: str, metrics: List[Metric]) -> None:
+    from mlflow.tracking import MlflowClient
+
+    # One log_batch request per chunk instead of one request per metric
+    client = MlflowClient()
+    for start in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+        chunk = metrics[start : start + MAX_METRICS_PER_BATCH]
+        client.log_batch(run_id, metrics=chunk)
+
+    logger.info("Logged %d metrics to MLflow", len(metrics))
+
+
+def log_metrics_table(metrics: List[Metric], table_path: str) -> None:
+    import mlflow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Whole sweep as one (step, key, value, timestamp) parquet artifact
+    table = pa.table(
+        {
+            "step": [m.step for m in metrics],
+            "key": [m.key for m in metrics],
+            "value": [m.value for m in metrics],
+            "timestamp": [m.timestamp for m in metrics],
+        }
+    )
+    pq.write_table(table, table_path, compression="zstd", use_dictionary=True)
+    mlflow.log_artifact(table_path, "metrics")
+
+    logger.info("Logged metrics table with %d rows", table.num_rows)
+
+
 def run_guidellm_cli(
     target: str,
     model: str,
@@ -157,26 +310,32 @@ def run_guidellm_cli(
     if processor:
         cmd.extend(["--processor", processor])
 
-    logger.info(f"Running guidellm command: {' '.join(cmd)}")
-
-    console_log_path = output_path.replace(".json", "_console.log")
-
-    try:
-        with open(console_log_path, "w") as log_file:
-            _ = subprocess.run(
-                cmd,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                text=True,
-                check=True,
-            )
-
+    logger.info("Running guidellm command: %s", " ".join(cmd))
+
+    output_file = Path(output_path)
+    console_log_path = str(output_file.with_name(f"{output_file.stem}_console.log.gz"))
+
+    # stderr is merged into stdout, so a single reader can drain the pipe and
+    # compress the raw output into the console log as it arrives
+    with gzip.open(console_log_path, "wb", compresslevel=3) as log_file:
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        ) as proc:
+            try:
+                shutil.copyfileobj(proc.stdout, log_file)
+            except BaseException:
+                # Same as subprocess.run: never leave guidellm running behind
+                proc.kill()
+                proc.wait()
+                raise
+            returncode = proc.wait()
+
+    if returncode == 0:
         logger.info("Guidellm completed successfully")
-        return output_path, console_log_path
+    else:
+        logger.error("Guidellm command failed with return code %d", returncode)
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Guidellm command failed with return code {e.returncode}")
-        return output_path, console_log_path
+    return output_path, console_log_path
 
 
 def run_benchmark_with_mlflow(
@@ -194,6 +353,8 @@ def run_benchmark_with_mlflow(
     mlflow_tracking_uri: str = None,
     tags: Dict[str, str] = None,
 ) -> str:
+    import mlflow
+
     if mlflow_tracking_uri:
         mlflow.set_tracking_uri(mlflow_tracking_uri)
 
@@ -204,7 +365,7 @@ def run_benchmark_with_mlflow(
         f"{model.split('/')[-1]}_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     )
 
-    logger.info(f"Starting benchmark sweep: rates={rate}")
+    logger.info("Starting benchmark sweep: rates=%s", rate)
 
     with mlflow.start_run(run_name=run_name) as run:
         try:
@@ -217,13 +378,13 @@ def run_benchmark_with_mlflow(
                 "rates": rate,
             }
             if data:
-                # params["data"] = data  # log data profile splitted
-                params.update(
-                    {
-                        d.split("=")[0].strip(): d.split("=")[1].strip()
-                        for d in data.split(",")
-                    }
-                )
+                # Log a synthetic data profile split into its key=value entries,
+                # anything else (dataset name, file path, malformed profile) as-is
+                data_params = parse_data_params(data)
+                if data_params:
+                    params.update(data_params)
+                else:
+                    params["data"] = data
             if max_seconds:
                 params["max_seconds"] = max_seconds
             if max_requests:
@@ -247,6 +408,7 @@ def run_benchmark_with_mlflow(
             mlflow.set_tags(default_tags)
 
             output_json = "/tmp/benchmark_sweep.json"
+            metrics_table_path = "/tmp/benchmark_sweep_metrics.parquet"
             json_path, console_log_path = run_guidellm_cli(
                 target=target,
                 model=model,
@@ -260,67 +422,33 @@ def run_benchmark_with_mlflow(
                 output_path=output_json,
             )
 
-            if Path(json_path).exists():
-                with open(json_path, "r") as f:
-                    result_json = json.load(f)
-
-                benchmarks = result_json.get("benchmarks", [])
-                if not benchmarks:
-                    logger.warning("No benchmarks found in JSON output")
-
-                logger.info(f"Found {len(benchmarks)} benchmark results in JSON.")
-
-                for benchmark in benchmarks:
-                    concurrency_step = 0
-                    try:
-                        concurrency_step = int(benchmark["args"]["strategy"]["streams"])
-                    except (KeyError, TypeError, IndexError):
-                        try:
-                            # Fallback for other strategies
-                            concurrency_step = int(
-                                benchmark["args"]["profile"]["measured_concurrencies"][
-                                    0
-                                ]
-                            )
-                        except (KeyError, TypeError, IndexError):
-                            logger.warning(
-                                "Could not find concurrency 'streams' or 'measured_concurrencies'. "
-                                "Metrics will be logged without a step."
-                            )
-
-                    metrics = extract_metrics_from_benchmark(benchmark)
-
-                    if metrics:
-                        # Log each metric with the concurrency as the step
-                        for key, value in metrics.items():
-                            mlflow.log_metric(key, value, step=concurrency_step)
-
-                        logger.info(
-                            f"Logged {len(metrics)} metrics for step "
-                            f"(concurrency={concurrency_step})"
-                        )
+            metrics_batch = collect_sweep_metrics(json_path)
+            if metrics_batch is not None:
+                if metrics_batch:
+                    log_metrics_batch(run.info.run_id, metrics_batch)
+                    log_metrics_table(metrics_batch, metrics_table_path)
 
                 mlflow.log_artifact(json_path, "results")
                 logger.info("Logged full JSON artifact")
             else:
-                logger.warning(f"Output JSON not found: {json_path}")
+                logger.warning("Output JSON not found: %s", json_path)
 
-            if Path(console_log_path).exists():
+            try:
                 mlflow.log_artifact(console_log_path, "logs")
                 logger.info("Logged console output")
-            else:
-                logger.warning(f"Console log not found: {console_log_path}")
+            except FileNotFoundError:
+                logger.warning("Console log not found: %s", console_log_path)
 
-            logger.info(f"Run completed: {run.info.run_id}")
+            logger.info("Run completed: %s", run.info.run_id)
             return run.info.run_id
 
         except Exception as e:
-            logger.error(f"Benchmark sweep failed: {e}")
+            logger.error("Benchmark sweep failed: %s", e)
             mlflow.log_param("error", str(e))
             raise
 
 
-def main():
+def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="GuideLLM Benchmark with MLflow Logging",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -350,7 +478,14 @@ def main():
         "--tag", action="append", dest="tags", help="Additional tags (key=value)"
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+_PARSER = _build_parser()
+
+
+def main():
+    args = _PARSER.parse_args()
 
     tags = {}
     if args.tags:
@@ -358,13 +493,14 @@ def main():
             key, value = tag.split("=", 1)
             tags[key.strip()] = value.strip()
 
-    logger.info(f"Starting benchmark sweep for rates: {args.rate}")
+    logger.info("Starting benchmark sweep for rates: %s", args.rate)
 
     # Log in to HF
-    subprocess.run(
-        ["huggingface-cli", "login", "--token", os.environ.get("HF_CLI_TOKEN")],
-        check=True,
-    )
+    hf_token = os.environ.get("HF_CLI_TOKEN")
+    if hf_token:
+        from huggingface_hub import login
+
+        login(token=hf_token, add_to_git_credential=False)
 
     try:
         run_id = run_benchmark_with_mlflow(
@@ -383,10 +519,10 @@ def main():
             tags=tags,
         )
         logger.info("\nBenchmark sweep completed successfully.")
-        logger.info(f"  MLflow Run ID: {run_id}")
+        logger.info("  MLflow Run ID: %s", run_id)
         return 0
     except Exception as e:
-        logger.error(f"Benchmark sweep failed: {e}")
+        logger.error("Benchmark sweep failed: %s", e)
         return 1
 
 